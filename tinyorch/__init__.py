@@ -1,3 +1,12 @@
-from .core import notify, run, run_parallel, keep_awake, prompt_enter, burn_iso, ensure_docker_host, watch_darwin, watch_linux
+__all__ = ("notify", "notify_sync", "get_password", "run", "run_parallel", "run_parallel_async", "keep_awake", "prompt_enter", "burn_iso", "ensure_docker_host", "watch_darwin", "watch_linux")
+
+
+def __getattr__(name):
+    if name in __all__:
+        from . import core
+
+        value = getattr(core, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-__all__ = ["notify", "get_password", "run", "run_parallel", "keep_awake", "prompt_enter", "burn_iso", "ensure_docker_host", "watch_darwin", "watch_linux"]
@@ -1,14 +1,13 @@
 # tinyorch/cli.py
 from __future__ import annotations
 
-import argparse
 import os
 import shlex
 import sys
 from pathlib import Path
 
 from .core import (
-    notify as _notify,
+    notify_sync as _notify,
     get_password as _get_password,
     run as _run_stage,
     run_parallel as _run_parallel,
@@ -21,10 +20,43 @@ from .core import (
 )
 
 
-def main_notify(argv: list[str] | None = None) -> None:
+def _fast_parse(
+    argv: list[str],
+    required: tuple[str, ...],
+    optional: tuple[str, ...] = (),
+    options: tuple[str, ...] = (),
+) -> dict[str, str | None] | None:
+    # Handles the plain "positionals + --opt VALUE" shapes without importing
+    # argparse. Returns None for anything else (--help, typos, "--", ...) so
+    # the caller can defer to the full argparse parser for exact semantics.
+    values: dict[str, str | None] = {o[2:].replace("-", "_"): None for o in options}
+    positionals: list[str] = []
+    it = iter(argv)
+    for arg in it:
+        if not arg.startswith("-") or arg == "-":
+            positionals.append(arg)
+            continue
+        name, eq, value = arg.partition("=")
+        if name not in options:
+            return None
+        if not eq:
+            value = next(it, None)
+            if value is None or value.startswith("-"):
+                return None
+        values[name[2:].replace("-", "_")] = value
+    if not len(required) <= len(positionals) <= len(required) + len(optional):
+        return None
+    values.update(dict.fromkeys(optional))
+    values.update(zip((*required, *optional), positionals))
+    return values
+
+
+def _notify_parser():
+    import argparse
+
     parser = argparse.ArgumentParser(
         prog="notify",
-        description="Send a notification via Apprise using tinyorch.core.notify",
+        description="Send a notification via Apprise using tinyorch.core.notify_sync",
     )
     parser.add_argument("message", help="Notification message body")
     parser.add_argument(
@@ -38,11 +70,20 @@ def main_notify(argv: list[str] | None = None) -> None:
             "May be a single URL or a comma-separated list."
         ),
     )
-    ns = parser.parse_args(argv)
-    _notify(ns.message, title=ns.title, url=ns.url)
+    return parser
 
 
-def main_get_password(argv: list[str] | None = None) -> None:
+def main_notify(argv: list[str] | None = None) -> None:
+    args = sys.argv[1:] if argv is None else argv
+    ns = _fast_parse(args, ("message",), options=("--title", "--url"))
+    if ns is None:
+        ns = vars(_notify_parser().parse_args(args))
+    _notify(ns["message"], title=ns["title"], url=ns["url"])
+
+
+def _get_password_parser():
+    import argparse
+
     parser = argparse.ArgumentParser(
         prog="get-password",
         description="Retrieve a password using get_password, prompting and storing it if needed.",
@@ -55,12 +96,21 @@ def main_get_password(argv: list[str] | None = None) -> None:
         "--account",
         help="Account / username (defaults to $USER or current login user)",
     )
-    ns = parser.parse_args(argv)
-    password = _get_password(ns.identifier, account=ns.account)
+    return parser
+
+
+def main_get_password(argv: list[str] | None = None) -> None:
+    args = sys.argv[1:] if argv is None else argv
+    ns = _fast_parse(args, ("identifier",), options=("--account",))
+    if ns is None:
+        ns = vars(_get_password_parser().parse_args(args))
+    password = _get_password(ns["identifier"], account=ns["account"])
     print(password)
 
 
 def main_run(argv: list[str] | None = None) -> None:
+    import argparse
+
     parser = argparse.ArgumentParser(
         prog="run",
         description="Run a named stage with retries using tinyorch.core.run",
@@ -83,13 +133,21 @@ def main_run(argv: list[str] | None = None) -> None:
     parser.add_argument(
         "--delay",
         type=float,
-        default=0.0,
-        help="Delay in seconds between retries",
+        default=None,
+        help=(
+            "Base delay in seconds between retries, doubled per attempt with "
+            "jitter (default: $TINYORCH_BACKOFF_BASE or 1; 0 = no delay)"
+        ),
     )
     parser.add_argument(
         "--success-msg",
         help="Optional notification message on success",
     )
+    parser.add_argument(
+        "--stderr-tail",
+        action="store_true",
+        help="Include the end of the command's stderr in failure notifications",
+    )
     parser.add_argument(
         "cmd",
         nargs=argparse.REMAINDER,
@@ -117,11 +175,14 @@ def main_run(argv: list[str] | None = None) -> None:
         retries=retries,
         delay=ns.delay,
         success_msg=ns.success_msg,
+        stderr_tail=ns.stderr_tail,
     )
 
 
 
 def main_run_parallel(argv: list[str] | None = None) -> None:
+    import argparse
+
     parser = argparse.ArgumentParser(
         prog="run-parallel",
         description="Run multiple commands in parallel using tinyorch.core.run_parallel",
@@ -154,7 +215,9 @@ def main_run_parallel(argv: list[str] | None = None) -> None:
     _run_parallel(cmds)
 
 
-def main_keep_awake(argv: list[str] | None = None) -> None:
+def _keep_awake_parser():
+    import argparse
+
     parser = argparse.ArgumentParser(
         prog="keep-awake",
         description="Prevent the system from sleeping while the given process is running",
@@ -164,12 +227,21 @@ def main_keep_awake(argv: list[str] | None = None) -> None:
         type=int,
         help="Process ID to keep awake",
     )
-    ns = parser.parse_args(argv)
+    return parser
 
-    _keep_awake(ns.pid)
 
+def main_keep_awake(argv: list[str] | None = None) -> None:
+    args = sys.argv[1:] if argv is None else argv
+    ns = _fast_parse(args, ("pid",))
+    if ns is None or not ns["pid"].isdigit():
+        ns = vars(_keep_awake_parser().parse_args(args))
+
+    _keep_awake(int(ns["pid"]))
+
+
+def _prompt_enter_parser():
+    import argparse
 
-def main_prompt_enter(argv: list[str] | None = None) -> None:
     parser = argparse.ArgumentParser(
         prog="prompt-enter",
         description="Prompt the user to press Enter using tinyorch.core.prompt_enter",
@@ -180,11 +252,20 @@ def main_prompt_enter(argv: list[str] | None = None) -> None:
         default=None,
         help="Optional custom prompt message",
     )
-    ns = parser.parse_args(argv)
-    _prompt_enter(ns.message)
+    return parser
+
+
+def main_prompt_enter(argv: list[str] | None = None) -> None:
+    args = sys.argv[1:] if argv is None else argv
+    ns = _fast_parse(args, (), ("message",))
+    if ns is None:
+        ns = vars(_prompt_enter_parser().parse_args(args))
+    _prompt_enter(ns["message"])
 
 
 def main_burn_iso(argv: list[str] | None = None) -> None:
+    import argparse
+
     parser = argparse.ArgumentParser(
         prog="burn-iso",
         description="Burn an ISO image to disc using tinyorch.core.burn_iso",
@@ -199,6 +280,9 @@ def main_burn_iso(argv: list[str] | None = None) -> None:
 
 
 def main_ensure_docker_host(argv: list[str] | None = None) -> None:
+    import argparse
+    import json
+
     parser = argparse.ArgumentParser(
         prog="ensure-docker-host",
         description="Ensure a Docker-compatible Podman socket for the given PID and print env exports",
@@ -233,6 +317,8 @@ def main_ensure_docker_host(argv: list[str] | None = None) -> None:
 
 
 def main_watch_darwin(argv: list[str] | None = None) -> None:
+    import argparse
+
     parser = argparse.ArgumentParser(
         prog="watch_darwin",
         description="Watch a tinyorch Podman machine and clean it up when parent exits",
@@ -246,6 +332,8 @@ def main_watch_darwin(argv: list[str] | None = None) -> None:
 
 
 def main_watch_linux(argv: list[str] | None = None) -> None:
+    import argparse
+
     parser = argparse.ArgumentParser(
         prog="watch_linux",
         description="Watch a Podman system service and clean it up when parent exits",
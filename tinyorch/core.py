@@ -1,15 +1,22 @@
+import atexit
+import errno
 import getpass
+import json
 import os
 import platform
+import re
+import select
 import shlex
 import shutil
 import signal
 import stat
+import struct
 import subprocess
 import sys
-import time
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import time
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 from collections.abc import Callable
 from typing import Dict, Iterable, Set
@@ -24,36 +31,302 @@ RUN_DIR.mkdir(parents=True, exist_ok=True)
 TMP_DIR.mkdir(parents=True, exist_ok=True)
 
 
+@lru_cache(maxsize=None)
+def _which(name: str) -> str | None:
+    return shutil.which(name)
+
+
+@lru_cache(maxsize=None)
+def _system() -> str:
+    return platform.system()
+
+
+@lru_cache(maxsize=None)
+def _release() -> str:
+    return platform.release()
+
+
+# Arguments shlex.quote() would return unchanged.
+_SAFE_ARG = re.compile(r"[\w@%+=:,./-]+", re.ASCII)
+
+
 def print_cmd(*args):
-    line = " ".join(shlex.quote(str(a)) for a in args)
-    print()
-    print("$ " + line)
+    line = " ".join(a if _SAFE_ARG.fullmatch(a) else shlex.quote(a) for a in map(str, args))
+    print("\n$ " + line)
+
+
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_IGNORED = 0x00008000
+
+
+@contextmanager
+def _dir_watch(dirs):
+    """
+    Watch directories for new entries (inotify on Linux, kqueue on BSD/macOS).
+
+    Yields ``wait(timeout=None)``, which blocks until something is created in
+    or moved into one of ``dirs`` and returns the set of new entry names, an
+    empty set on timeout, or None when the platform can't tell which entries
+    changed (kqueue). Raises OSError when no notification API is available or
+    a watched directory goes away, so callers can fall back to polling.
+    """
+    dirs = {os.fspath(d) for d in dirs}
+    if sys.platform.startswith("linux"):
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        try:
+            for d in dirs:
+                if libc.inotify_add_watch(fd, os.fsencode(d), _IN_CREATE | _IN_MOVED_TO) < 0:
+                    err = ctypes.get_errno()
+                    raise OSError(err, os.strerror(err), d)
+            # poll() rather than select(), which can't take fds >= FD_SETSIZE.
+            poller = select.poll()
+            poller.register(fd, select.POLLIN)
+
+            def wait(timeout=None):
+                names: Set[str] = set()
+                if not poller.poll(None if timeout is None else timeout * 1000):
+                    return names
+                buf = os.read(fd, 65536)
+                offset = 0
+                while offset < len(buf):
+                    _, mask, _, length = struct.unpack_from("iIII", buf, offset)
+                    if mask & _IN_IGNORED:
+                        raise OSError(errno.ENOENT, "watched directory removed")
+                    offset += 16
+                    names.add(os.fsdecode(buf[offset : offset + length].rstrip(b"\0")))
+                    offset += length
+                return names
+
+            yield wait
+        finally:
+            os.close(fd)
+    elif hasattr(select, "kqueue"):
+        kq = select.kqueue()
+        fds: list[int] = []
+        gone = select.KQ_NOTE_DELETE | select.KQ_NOTE_RENAME
+        try:
+            for d in dirs:
+                fds.append(os.open(d, os.O_RDONLY))
+            kq.control(
+                [
+                    select.kevent(
+                        fd,
+                        filter=select.KQ_FILTER_VNODE,
+                        flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+                        fflags=select.KQ_NOTE_WRITE | gone,
+                    )
+                    for fd in fds
+                ],
+                0,
+            )
+
+            def wait(timeout=None):
+                events = kq.control(None, len(fds), timeout)
+                if any(ev.fflags & gone for ev in events):
+                    raise OSError(errno.ENOENT, "watched directory removed")
+                return None if events else set()
+
+            yield wait
+        finally:
+            for fd in fds:
+                os.close(fd)
+            kq.close()
+    else:
+        raise OSError(errno.ENOSYS, "no directory change notification API")
 
 
 def wait_for_files(paths, interval=5):
     ps = [p if isinstance(p, Path) else Path(p) for p in paths]
+    pending = [p for p in ps if not p.exists()]
+    if not pending:
+        return
+    try:
+        with _dir_watch(p.parent for p in pending) as wait:
+            while True:
+                # Re-check after the watch is armed so files created in
+                # between are not missed.
+                pending = [p for p in pending if not p.exists()]
+                if not pending:
+                    return
+                wanted = {p.name for p in pending}
+                # Only re-stat when one of the awaited names shows up, or
+                # every `interval` in case an event never arrives (network
+                # filesystems, re-pointed symlinked parents).
+                names = wait(interval)
+                while names and names.isdisjoint(wanted):
+                    names = wait(interval)
+    except OSError:
+        pass
     while True:
         if all(p.exists() for p in ps):
             return
         time.sleep(interval)
 
 
-def notify(
-    message: str,
-    title: str | None = None,
-    url: str | None = None,
-) -> None:
+def _docker() -> str:
+    # Resolve once so every docker invocation skips the exec-time PATH walk.
+    return _which("docker") or "docker"
+
+
+APPRISE_IMAGE = "caronc/apprise:latest"
+# How long a prewarmed apprise container lives. It exits on its own after
+# this, so one left behind by a killed process doesn't linger.
+APPRISE_CONTAINER_TTL = 600
+
+_apprise_lock = threading.Lock()
+_apprise_container: str | None = None
+_apprise_starter: subprocess.Popen | None = None
+_apprise_started = 0.0
+_apprise_seq = 0
+_apprise_disabled = False
+_apprise_calls = 0
+# How long exit waits for a still-running `docker run -d` before killing it.
+APPRISE_STARTER_EXIT_TIMEOUT = 10.0
+
+
+def _apprise_prefix(prewarm: bool) -> list[str]:
+    """
+    Return the command prefix used to run apprise.
+
+    Uses `docker exec` into this process's warm container when one is up, and
+    a one-off `docker run --rm` otherwise. With ``prewarm`` a missing or
+    expiring container is started in the background for later calls, but
+    only from the second notification on: a process that notifies once
+    gains nothing from it.
+    """
+    global _apprise_container, _apprise_starter, _apprise_started, _apprise_seq, _apprise_disabled
+    global _apprise_calls
+    docker = _docker()
+    one_off = [docker, "run", "--rm", APPRISE_IMAGE]
+    with _apprise_lock:
+        _apprise_calls += 1
+        if _apprise_disabled:
+            return one_off
+        now = time.monotonic()
+        if _apprise_starter is not None:
+            rc = _apprise_starter.poll()
+            if rc is None:
+                return one_off
+            if rc != 0:
+                _apprise_disabled = True
+                return one_off
+            # Leave a margin so an exec doesn't race the container's exit.
+            if now - _apprise_started < APPRISE_CONTAINER_TTL - 60:
+                return [docker, "exec", _apprise_container]
+        if not prewarm or _apprise_calls < 2:
+            return one_off
+        _apprise_seq += 1
+        name = f"tinyorch-apprise-{os.getpid()}-{_apprise_seq}"
+        try:
+            _apprise_starter = subprocess.Popen(
+                [
+                    docker,
+                    "run",
+                    "-d",
+                    "--rm",
+                    "--name",
+                    name,
+                    "--entrypoint",
+                    "sleep",
+                    APPRISE_IMAGE,
+                    str(APPRISE_CONTAINER_TTL),
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                stdin=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except OSError:
+            _apprise_disabled = True
+            return one_off
+        if _apprise_container is None:
+            _register_notify_exit()
+        _apprise_container = name
+        _apprise_started = now
+        return one_off
+
+
+def _stop_apprise(timeout: float = APPRISE_STARTER_EXIT_TIMEOUT) -> None:
+    with _apprise_lock:
+        starter, name = _apprise_starter, _apprise_container
+    if starter is None or name is None:
+        return
+    try:
+        rc = starter.wait(timeout=min(timeout, APPRISE_STARTER_EXIT_TIMEOUT))
+    except subprocess.TimeoutExpired:
+        # Killing the client doesn't stop the daemon from creating the
+        # container, so fall through and remove it by name regardless.
+        starter.kill()
+        starter.wait()
+    else:
+        if rc != 0:
+            return
+    try:
+        subprocess.Popen(
+            [_docker(), "rm", "-f", name],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError:
+        pass
+
+
+@lru_cache(maxsize=8)
+def _notify_urls(value: str) -> tuple[str, ...]:
+    return tuple(u.strip() for u in value.split(",") if u.strip())
+
+
+@lru_cache(maxsize=8)
+def _apprise_app(urls: tuple[str, ...]):
+    """
+    Return an in-process Apprise instance for ``urls``, or None when the
+    apprise library isn't installed (callers then fall back to the container).
+    """
+    try:
+        import apprise
+    except ImportError:
+        return None
+    app = apprise.Apprise()
+    for u in urls:
+        app.add(u)
+    return app
+
+
+def _notify_target(title: str | None, url: str | None) -> tuple[str, tuple[str, ...]]:
+    raw = url if url is not None else os.environ.get("NOTIFY")
+    if not raw:
+        # Notifications not configured: the common case, keep it to a lookup.
+        return "", ()
     if title is None:
         title = os.getenv("JOB", "job")
-    urls_value = url if url is not None else os.getenv("NOTIFY", "")
-    urls = [u.strip() for u in urls_value.split(",") if u.strip()]
-    if not urls:
-        return
-    cmd = [
-        "docker",
-        "run",
-        "--rm",
-        "caronc/apprise:latest",
+    return title, _notify_urls(raw)
+
+
+def _notify_in_process(app, message: str, title: str) -> None:
+    try:
+        if not app.notify(body=message, title=title):
+            print("notify failed: apprise reported no successful delivery", file=sys.stderr)
+    except Exception as e:
+        print(f"notify failed: {e!r}", file=sys.stderr)
+
+
+def _notify_cmd(
+    message: str,
+    title: str,
+    urls: tuple[str, ...],
+    prewarm: bool = True,
+) -> list[str]:
+    return [
+        *_apprise_prefix(prewarm),
         "apprise",
         "-t",
         title,
@@ -61,6 +334,88 @@ def notify(
         message,
         *urls,
     ]
+
+
+_pending_notifies: list[subprocess.Popen] = []
+_pending_notifies_lock = threading.Lock()
+NOTIFY_EXIT_TIMEOUT = 60.0
+
+
+def _reap_notifies() -> None:
+    with _pending_notifies_lock:
+        pending = []
+        for proc in _pending_notifies:
+            rc = proc.poll()
+            if rc is None:
+                pending.append(proc)
+            elif rc != 0:
+                print(f"notify failed: exit status {rc}", file=sys.stderr)
+        _pending_notifies[:] = pending
+
+
+def _wait_notifies(timeout: float = NOTIFY_EXIT_TIMEOUT) -> None:
+    deadline = time.monotonic() + timeout
+    with _pending_notifies_lock:
+        pending = list(_pending_notifies)
+    for proc in pending:
+        try:
+            proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            pass
+    _reap_notifies()
+
+
+def notify(
+    message: str,
+    title: str | None = None,
+    url: str | None = None,
+) -> None:
+    """
+    Send a notification in the background and return immediately.
+
+    Pending deliveries, in-process or via the container, are awaited for up
+    to NOTIFY_EXIT_TIMEOUT seconds at interpreter exit; use notify_sync() to
+    block until this notification is sent.
+    """
+    title, urls = _notify_target(title, url)
+    if not urls:
+        return
+    app = _apprise_app(urls)
+    if app is not None:
+        _submit_notify(_notify_in_process, app, message, title)
+        return
+    cmd = _notify_cmd(message, title, urls)
+    _reap_notifies()
+    try:
+        print_cmd(*cmd)
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except Exception as e:
+        print(f"notify failed: {e!r}", file=sys.stderr)
+        return
+    _register_notify_exit()
+    with _pending_notifies_lock:
+        _pending_notifies.append(proc)
+
+
+def notify_sync(
+    message: str,
+    title: str | None = None,
+    url: str | None = None,
+) -> None:
+    title, urls = _notify_target(title, url)
+    if not urls:
+        return
+    app = _apprise_app(urls)
+    if app is not None:
+        _notify_in_process(app, message, title)
+        return
+    cmd = _notify_cmd(message, title, urls, prewarm=False)
     try:
         print_cmd(*cmd)
         subprocess.run(cmd, check=True)
@@ -68,17 +423,97 @@ def notify(
         print(f"notify failed: {e!r}", file=sys.stderr)
 
 
+_notify_queue = None
+_notify_queue_lock = threading.Lock()
+
+
+def _notify_worker(q) -> None:
+    while True:
+        fn, args = q.get()
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"notify failed: {e!r}", file=sys.stderr)
+
+
+_notify_exit_registered = False
+_notify_exit_lock = threading.Lock()
+
+
+def _register_notify_exit() -> None:
+    global _notify_exit_registered
+    with _notify_exit_lock:
+        if not _notify_exit_registered:
+            atexit.register(_notify_at_exit)
+            _notify_exit_registered = True
+
+
+def _notify_at_exit(timeout: float = NOTIFY_EXIT_TIMEOUT) -> None:
+    # One handler, in dependency order, against one deadline: queued jobs may
+    # spawn container sends, and those may exec into the warm container, so
+    # it is removed last.
+    deadline = time.monotonic() + timeout
+    if _notify_queue is not None:
+        # The worker runs jobs in order, so once this marker is reached
+        # everything queued before it has been handled.
+        drained = threading.Event()
+        _notify_queue.put((drained.set, ()))
+        drained.wait(timeout)
+    _wait_notifies(max(0.0, deadline - time.monotonic()))
+    _stop_apprise(max(0.0, deadline - time.monotonic()))
+
+
+def _submit_notify(fn: Callable, *args) -> None:
+    # Hand the work to a single worker so the caller can move on to the next
+    # stage. The worker is a daemon thread so the bounded drain at exit, not
+    # an unbounded thread join, decides how long delivery may hold us up.
+    global _notify_queue
+    with _notify_queue_lock:
+        if _notify_queue is None:
+            import queue
+
+            _notify_queue = queue.SimpleQueue()
+            threading.Thread(
+                target=_notify_worker, args=(_notify_queue,), name="tinyorch-notify", daemon=True
+            ).start()
+            _register_notify_exit()
+        _notify_queue.put((fn, args))
+
+
+def _notify_job(message: str) -> None:
+    # Already on the notify worker: deliver in-process directly, or leave the
+    # container run to notify() (which only spawns and returns).
+    title, urls = _notify_target(None, None)
+    app = _apprise_app(urls) if urls else None
+    if app is not None:
+        _notify_in_process(app, message, title)
+    else:
+        notify(message, title)
+
+
+def _notify_in_background(message: str) -> None:
+    # Nothing to send: don't start the worker or register the exit drain.
+    if not _notify_target(None, None)[1]:
+        return
+    _submit_notify(_notify_job, message)
+
+
+@lru_cache(maxsize=None)
+def _login_name() -> str:
+    # The uid -> name lookup goes through NSS (possibly LDAP/SSSD) and can't
+    # change for the life of the process.
+    import pwd
+
+    return pwd.getpwuid(os.getuid()).pw_name
+
+
 def get_password(identifier: str, account: str | None = None) -> str:
     if not identifier:
         raise ValueError("identifier must be non-empty")
 
-    system = platform.system()
+    system = _system()
     if account is None:
-        account = os.environ.get("USER")
-        if not account:
-            import pwd
-
-            account = pwd.getpwuid(os.getuid()).pw_name
+        account = os.environ.get("USER") or _login_name()
 
     if system == "Darwin":
         proc = _run(
@@ -89,7 +524,7 @@ def get_password(identifier: str, account: str | None = None) -> str:
         if proc.returncode == 0 and proc.stdout:
             return proc.stdout.strip()
     elif system == "Linux":
-        if shutil.which("secret-tool") is None:
+        if _which("secret-tool") is None:
             raise RuntimeError(
                 "secret-tool not found; install libsecret-tools or provide password another way"
             )
@@ -124,48 +559,211 @@ def get_password(identifier: str, account: str | None = None) -> str:
             check=False,
         )
     elif system == "Linux":
-        proc = subprocess.Popen(
-            [
-                "secret-tool",
-                "store",
-                f"--label={identifier}",
-                "service",
-                identifier,
-                "account",
-                account,
-            ],
-            stdin=subprocess.PIPE,
-            text=True,
-        )
         try:
-            proc.communicate(password, timeout=10)
+            subprocess.run(
+                [
+                    "secret-tool",
+                    "store",
+                    f"--label={identifier}",
+                    "service",
+                    identifier,
+                    "account",
+                    account,
+                ],
+                input=password.encode("utf-8"),
+                timeout=10,
+                check=False,
+            )
         except subprocess.TimeoutExpired:
-            proc.kill()
-            proc.communicate()
+            pass
 
     return password
 
 
-def _run_once(cmd: str | list[str] | Callable[[], None]) -> None:
+# Anything the shell would interpret (pipes, redirects, expansions, quoting,
+# globs, variable assignments, ...) keeps a string command on the shell path.
+_SHELL_METACHARS = re.compile(r"[|&;<>()$`\\\"'*?\[\]{}#~=%!\n]")
+
+
+# exec() failures that sh would get past or report itself.
+_SHELL_FALLBACK_ERRNOS = (errno.ENOENT, errno.ENOEXEC, errno.EACCES)
+
+
+def _split_command(cmd: str) -> list[str] | None:
+    """Return argv for running ``cmd`` without a shell, or None if it needs one."""
+    if _SHELL_METACHARS.search(cmd):
+        return None
+    return shlex.split(cmd) or None
+
+
+# How much of a failed command's stderr is kept for the failure notification.
+STDERR_TAIL_BYTES = 4096
+
+
+def _call(args, shell: bool = False, tail: bool = False) -> None:
+    if not tail:
+        subprocess.run(args, shell=shell, check=True)
+        return
+    # Pass stderr through as it arrives while keeping its tail, so the error
+    # can be attached to the notification without rerunning the stage.
+    out = getattr(sys.stderr, "buffer", None)
+    kept = bytearray()
+    kept_lock = threading.Lock()
+    proc = subprocess.Popen(args, shell=shell, stderr=subprocess.PIPE)
+
+    def pump() -> None:
+        with proc.stderr:
+            fd = proc.stderr.fileno()
+            while chunk := os.read(fd, 65536):
+                if out is not None:
+                    out.write(chunk)
+                    out.flush()
+                else:
+                    sys.stderr.write(chunk.decode("utf-8", "replace"))
+                with kept_lock:
+                    kept.extend(chunk)
+                    del kept[:-STDERR_TAIL_BYTES]
+
+    reader = threading.Thread(target=pump, name="tinyorch-stderr", daemon=True)
+    reader.start()
+    try:
+        returncode = proc.wait()
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    # A background grandchild may keep the pipe open; don't wait on it.
+    reader.join(0.1)
+    if returncode:
+        with kept_lock:
+            stderr = kept.decode("utf-8", "replace")
+        raise subprocess.CalledProcessError(returncode, args, stderr=stderr)
+
+
+def _run_once(cmd: str | list[str] | Callable[[], None], tail: bool = False) -> None:
     if callable(cmd):
         cmd()
     elif isinstance(cmd, str):
-        subprocess.run(cmd, shell=True, check=True)
+        argv = _split_command(cmd)
+        if argv is None:
+            _call(cmd, shell=True, tail=tail)
+            return
+        try:
+            _call(argv, tail=tail)
+        except subprocess.CalledProcessError as e:
+            # Report the command as given, as the shell path and
+            # _run_once_async do, not the split argv.
+            raise subprocess.CalledProcessError(
+                e.returncode, cmd, output=e.output, stderr=e.stderr
+            ) from None
+        except OSError as e:
+            # Not something exec() can run directly (a shell builtin, a script
+            # without a shebang or exec bit, a directory); let sh handle it and
+            # report the error the way it used to.
+            if e.errno not in _SHELL_FALLBACK_ERRNOS:
+                raise
+            _call(cmd, shell=True, tail=tail)
     else:
-        subprocess.run(cmd, check=True)
+        _call(cmd, tail=tail)
+
+
+def _failure_detail(e: Exception) -> str:
+    stderr = getattr(e, "stderr", None)
+    if isinstance(stderr, str) and stderr.strip():
+        return f"{e}\n{stderr.strip()}"
+    return str(e)
+
+
+# Absolute RUN_DIR -> names of .done marks known to exist, seeded by one
+# listdir. Keyed on the absolute path so a relative RUN_DIR (the default ".")
+# still means the right directory after a chdir.
+_done_marks: Dict[str, Set[str]] = {}
+
+
+def _stage_done(run_dir: str, mark_name: str) -> bool:
+    key = os.path.abspath(run_dir)
+    marks = _done_marks.get(key)
+    if marks is None:
+        try:
+            marks = {n for n in os.listdir(run_dir) if n.endswith(".done")}
+        except OSError:
+            marks = set()
+        _done_marks[key] = marks
+    if mark_name in marks:
+        return True
+    # Marks written by another process after the snapshot still count.
+    try:
+        os.stat(os.path.join(run_dir, mark_name))
+    except OSError:
+        return False
+    marks.add(mark_name)
+    return True
+
+
+def _env_float(name: str, default: float) -> float:
+    """Read a finite, non-negative float from the environment, else ``default``."""
+    try:
+        value = float(os.getenv(name, ""))
+    except ValueError:
+        return default
+    return value if 0.0 <= value < float("inf") else default
+
+
+def _backoff(attempt: int, base: float) -> float:
+    """Exponential backoff with jitter for the sleep after ``attempt``."""
+    import random
+
+    cap = _env_float("TINYORCH_BACKOFF_CAP", 30.0)
+    # Past 2**32 the cap always wins; stop there so huge retry counts can't
+    # overflow the float.
+    step = min(cap, base * 2 ** min(attempt - 1, 32))
+    return step + random.random() * 0.5
+
+
+# One lock per mark path, so the same stage scheduled twice in one process
+# (e.g. from run_parallel callables) runs once and the other caller skips it.
+_stage_locks: Dict[str, threading.Lock] = {}
+_stage_locks_guard = threading.Lock()
+
+
+def _stage_lock(mark_path: str) -> threading.Lock:
+    with _stage_locks_guard:
+        lock = _stage_locks.get(mark_path)
+        if lock is None:
+            lock = _stage_locks[mark_path] = threading.Lock()
+        return lock
 
 
 def run(
     stage: str,
     cmd: str | list[str] | Callable[[], None],
     retries: int | None = 0,          # None => infinite / interactive retry
-    delay: float = 0.0,
+    delay: float | None = None,       # None => TINYORCH_BACKOFF_BASE (1s); 0 => no wait
     success_msg: str | None = None,
+    stderr_tail: bool = False,         # attach the last stderr lines to failure notifications
 ) -> None:
-    mark = Path(os.getenv("RUN_DIR", ".")) / f".{stage}.done"
-    if mark.exists():
+    run_dir = os.environ.get("RUN_DIR", ".")
+    mark_name = f".{stage}.done"
+    if _stage_done(run_dir, mark_name):
         return
 
+    with _stage_lock(os.path.join(os.path.abspath(run_dir), mark_name)):
+        # A concurrent run() of the same stage may have just completed it.
+        if _stage_done(run_dir, mark_name):
+            return
+        _run_attempts(stage, cmd, retries, delay, success_msg, stderr_tail, run_dir, mark_name)
+
+
+def _run_attempts(
+    stage: str,
+    cmd: str | list[str] | Callable[[], None],
+    retries: int | None,
+    delay: float | None,
+    success_msg: str | None,
+    stderr_tail: bool,
+    run_dir: str,
+    mark_name: str,
+) -> None:
     infinite = retries is None
     if not infinite and retries < 0:
         raise ValueError("retries must be None or >= 0")
@@ -174,15 +772,21 @@ def run(
     last_error: Exception | None = None
     max_attempts = None if infinite else retries + 1
 
+    # Piping stderr hides the terminal from the command, so only on request.
+    tail = stderr_tail and bool(_notify_target(None, None)[1])
+
     while infinite or attempt < max_attempts:
         attempt += 1
         try:
-            _run_once(cmd)
+            _run_once(cmd, tail=tail)
         except Exception as e:
             last_error = e
             if infinite:
-                notify(f"{stage} failed (attempt {attempt}): {e}")
-                if not sys.stdin.isatty():
+                notify(f"{stage} failed (attempt {attempt}): {_failure_detail(e)}")
+                # Only prompt from the main thread: a run() inside a
+                # run_parallel worker would otherwise block its peers on a
+                # terminal read they can't see.
+                if not sys.stdin.isatty() or threading.current_thread() is not threading.main_thread():
                     break
                 try:
                     answer = input(
@@ -193,15 +797,25 @@ def run(
                     break
                 if answer not in {"y", "yes"}:
                     break
+                if delay is not None and delay > 0:
+                    time.sleep(delay)
             else:
-                notify(f"{stage} failed ({attempt}/{max_attempts}): {e}")
-
-            if delay > 0:
-                time.sleep(delay)
+                notify(f"{stage} failed ({attempt}/{max_attempts}): {_failure_detail(e)}")
+                if attempt < max_attempts:
+                    base = _env_float("TINYORCH_BACKOFF_BASE", 1.0) if delay is None else delay
+                    # NaN fails this test; an infinite base is held to the cap.
+                    if base > 0:
+                        time.sleep(_backoff(attempt, base))
         else:
-            mark.touch()
+            # Path.touch() would try utime() first; the mark is new, so just
+            # create it. An existing one means another process finished too.
+            try:
+                os.close(os.open(os.path.join(run_dir, mark_name), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+            except FileExistsError:
+                pass
+            _done_marks.setdefault(os.path.abspath(run_dir), set()).add(mark_name)
             if success_msg:
-                notify(success_msg)
+                _notify_in_background(success_msg)
             return
 
     if last_error is not None:
@@ -209,14 +823,121 @@ def run(
     raise RuntimeError(f"stage {stage!r} failed")
 
 
+@lru_cache(maxsize=None)
+def _usable_cpus() -> int:
+    # Honour affinity masks (taskset, cpusets) rather than the host's count.
+    if hasattr(os, "sched_getaffinity"):
+        try:
+            return len(os.sched_getaffinity(0)) or 1
+        except OSError:
+            pass
+    return os.cpu_count() or 1
+
+
+def _max_parallel() -> int:
+    value = os.getenv("TINYORCH_MAX_PARALLEL", "")
+    if value:
+        try:
+            return max(1, int(value))
+        except ValueError:
+            pass
+    return max(2, _usable_cpus() * 2)
+
+
+async def _run_once_async(cmd: str | list[str] | Callable[[], None], pool=None) -> None:
+    import asyncio
+
+    if callable(cmd):
+        await asyncio.get_running_loop().run_in_executor(pool, cmd)
+        return
+    # Concurrent children would race each other (and any retry prompt) for
+    # the terminal, so they get no stdin.
+    stdin = subprocess.DEVNULL
+    if isinstance(cmd, str):
+        argv = _split_command(cmd)
+        if argv is None:
+            proc = await asyncio.create_subprocess_shell(cmd, stdin=stdin)
+        else:
+            try:
+                proc = await asyncio.create_subprocess_exec(*argv, stdin=stdin)
+            except OSError as e:
+                if e.errno not in _SHELL_FALLBACK_ERRNOS:
+                    raise
+                proc = await asyncio.create_subprocess_shell(cmd, stdin=stdin)
+    else:
+        proc = await asyncio.create_subprocess_exec(*cmd, stdin=stdin)
+    returncode = await proc.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+
+async def _run_parallel_async(cmds: list) -> None:
+    import asyncio
+
+    # Children are supervised by the event loop rather than a thread each;
+    # the semaphore bounds how many run at once (TINYORCH_MAX_PARALLEL).
+    width = min(len(cmds), _max_parallel())
+    limit = asyncio.Semaphore(width)
+    started: Set[int] = set()
+
+    # Callables get a pool of this call's own, sized to the same cap; a
+    # callable that itself calls run_parallel() then can't starve its
+    # children of workers.
+    pool = None
+    if any(callable(cmd) for cmd in cmds):
+        from concurrent.futures import ThreadPoolExecutor
+
+        pool = ThreadPoolExecutor(max_workers=width, thread_name_prefix="tinyorch-run")
+
+    async def run_one(i, cmd):
+        async with limit:
+            started.add(i)
+            await _run_once_async(cmd, pool)
+
+    tasks = [asyncio.create_task(run_one(i, cmd)) for i, cmd in enumerate(cmds)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            await next_done
+    except BaseException:
+        # Drop commands that haven't started; let running ones finish.
+        for i, task in enumerate(tasks):
+            if i not in started:
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+
+async def run_parallel_async(commands) -> None:
+    """Like run_parallel(), for callers already running an event loop."""
+    cmds = [c for c in commands if c]
+    if cmds:
+        await _run_parallel_async(cmds)
+
+
 def run_parallel(commands):
     cmds = [c for c in commands if c]
     if not cmds:
         return
-    with ThreadPoolExecutor(max_workers=len(cmds)) as pool:
-        futures = [pool.submit(_run_once, cmd) for cmd in cmds]
-        for f in futures:
-            f.result()
+    if len(cmds) == 1:
+        _run_once(cmds[0])
+        return
+    import asyncio
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(_run_parallel_async(cmds))
+        return
+    # Called from inside an event loop (Jupyter, async apps), where
+    # asyncio.run() refuses to nest: give the batch a loop of its own on a
+    # helper thread and block on it like the plain call would.
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="tinyorch-run") as helper:
+        helper.submit(asyncio.run, _run_parallel_async(cmds)).result()
 
 
 _keep_awake_proc = None
@@ -242,9 +963,9 @@ def keep_awake(pid: int | str):
         _keep_awake_proc = None
         _keep_awake_pid = None
 
-    if shutil.which("caffeinate"):
+    if _which("caffeinate"):
         cmd = ["caffeinate", "-i", "-w", target_pid]
-    elif shutil.which("systemd-inhibit") and platform.system() == "Linux":
+    elif _which("systemd-inhibit") and _system() == "Linux":
         cmd = [
             "systemd-inhibit",
             "--what=sleep",
@@ -254,7 +975,7 @@ def keep_awake(pid: int | str):
             "sleep",
             "infinity",
         ]
-    elif shutil.which("powershell.exe"):
+    elif _which("powershell.exe"):
         ps_script = r"""
 param($p)
 Add-Type @"
@@ -265,11 +986,9 @@ public static class A {
     public static extern uint SetThreadExecutionState(uint e);
 }
 "@
-$f=0x80000002
-while(Get-Process -Id $p -ErrorAction SilentlyContinue){
-    [A]::SetThreadExecutionState($f)|Out-Null
-    Start-Sleep 30
-}
+[A]::SetThreadExecutionState(0x80000002)|Out-Null
+try { Wait-Process -Id $p -ErrorAction SilentlyContinue } catch {}
+[A]::SetThreadExecutionState(0x80000000)|Out-Null
 """
         cmd = ["powershell.exe", "-WindowStyle", "Hidden", "-Command", ps_script, "--", target_pid]
     else:
@@ -297,116 +1016,208 @@ def prompt_enter(message=None):
         pass
 
 
+_BURN_TOOL_CHAIN = (
+    ("growisofs", lambda dev, iso: ["growisofs", "-speed=MAX", "-dvd-compat", "-Z", f"{dev}={iso}"]),
+    ("wodim", lambda dev, iso: ["wodim", f"dev={dev}", "speed=max", "-v", "-data", str(iso)]),
+    ("cdrecord", lambda dev, iso: ["cdrecord", f"dev={dev}", "speed=max", "-v", "-data", str(iso)]),
+)
+
+
+def _optical_device() -> str:
+    # One /dev listing answers for all candidates; only a listed name is
+    # stat'ed, to skip dangling symlinks like the old exists() probe did.
+    try:
+        with os.scandir("/dev") as it:
+            names = {e.name for e in it}
+    except OSError:
+        return ""
+    for name in ("dvd", "sr0", "cdrom"):
+        if name in names and os.path.exists(f"/dev/{name}"):
+            return f"/dev/{name}"
+    return ""
+
+
 def burn_iso(iso, device=None):
     iso_path = Path(iso)
     if not iso_path.is_file():
         raise FileNotFoundError(f"burn_iso: file not found: {iso_path}")
-    os_name = platform.system()
-    if os_name == "Darwin" and shutil.which("drutil"):
+    os_name = _system()
+    if os_name == "Darwin" and _which("drutil"):
         cmd = ["drutil", "burn", "-speed", "max", str(iso_path)]
         print_cmd(*cmd)
         subprocess.run(cmd, check=True)
         return
     if os_name == "Linux":
-        kernel = platform.release()
+        kernel = _release()
         if "Microsoft" not in kernel and "microsoft" not in kernel:
-            dev = device or os.getenv("BURN_DEV", "")
-            if not dev:
-                for candidate in ("/dev/dvd", "/dev/sr0", "/dev/cdrom"):
-                    if os.path.exists(candidate):
-                        dev = candidate
-                        break
+            dev = device or os.getenv("BURN_DEV", "") or _optical_device()
             if dev:
-                if shutil.which("growisofs"):
-                    cmd = [
-                        "growisofs",
-                        "-speed=MAX",
-                        "-dvd-compat",
-                        "-Z",
-                        f"{dev}={iso_path}",
-                    ]
-                    print_cmd(*cmd)
-                    subprocess.run(cmd, check=True)
-                    return
-                if shutil.which("wodim"):
-                    cmd = [
-                        "wodim",
-                        f"dev={dev}",
-                        "speed=max",
-                        "-v",
-                        "-data",
-                        str(iso_path),
-                    ]
-                    print_cmd(*cmd)
-                    subprocess.run(cmd, check=True)
-                    return
-                if shutil.which("cdrecord"):
-                    cmd = [
-                        "cdrecord",
-                        f"dev={dev}",
-                        "speed=max",
-                        "-v",
-                        "-data",
-                        str(iso_path),
-                    ]
-                    print_cmd(*cmd)
-                    subprocess.run(cmd, check=True)
-                    return
+                for tool, make_cmd in _BURN_TOOL_CHAIN:
+                    if _which(tool):
+                        cmd = make_cmd(dev, iso_path)
+                        print_cmd(*cmd)
+                        subprocess.run(cmd, check=True)
+                        return
     print(
         f"burn_iso: automatic burning not available; burn this ISO manually: {iso_path}",
         file=sys.stderr,
     )
 
 def _run(
-    args: Iterable[str],
+    args: list[str] | tuple[str, ...],
     *,
     check: bool = True,
     capture_output: bool = False,
 ) -> subprocess.CompletedProcess[str]:
     return subprocess.run(
-        list(args),
+        args,
         check=check,
         text=True,
         capture_output=capture_output,
     )
 
 
+def _run_bytes(args: list[str] | tuple[str, ...], *, check: bool = False) -> subprocess.CompletedProcess[bytes]:
+    # For output that is parsed as ASCII/JSON anyway; skips the locale decode.
+    return subprocess.run(args, check=check, capture_output=True)
+
+
+@lru_cache(maxsize=None)
+def _has_procfs() -> bool:
+    return _system() == "Linux" and os.path.isdir("/proc/self")
+
+
 def _pid_alive(pid: int) -> bool:
     if pid <= 0:
         return False
+    if _has_procfs():
+        # A /proc lookup skips kill()'s permission check and can't confuse
+        # "not ours" (EPERM) with "gone" (ESRCH).
+        return os.path.exists(f"/proc/{pid}")
     try:
         os.kill(pid, 0)
+    except PermissionError:
+        return True
     except OSError:
         return False
     return True
 
 
-def _read_state_pids(path: Path) -> Set[int]:
-    if not path.exists():
-        return set()
-    pids: Set[int] = set()
-    for line in path.read_text().splitlines():
-        line = line.strip()
-        if not line.isdigit():
+def _wait_pid_exit(pid: int, timeout: float | None = None) -> bool:
+    """
+    Block until ``pid`` exits; return False if ``timeout`` expires first.
+
+    Uses pidfd_open() + poll() on Linux and kqueue EVFILT_PROC on BSD/macOS,
+    falling back to polling _pid_alive() where neither is available.
+    """
+    try:
+        if hasattr(os, "pidfd_open"):
+            fd = os.pidfd_open(pid)
+            try:
+                poller = select.poll()
+                poller.register(fd, select.POLLIN)
+                return bool(poller.poll(None if timeout is None else timeout * 1000))
+            finally:
+                os.close(fd)
+        if hasattr(select, "kqueue"):
+            kq = select.kqueue()
+            try:
+                ev = select.kevent(
+                    pid,
+                    filter=select.KQ_FILTER_PROC,
+                    flags=select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
+                    fflags=select.KQ_NOTE_EXIT,
+                )
+                return bool(kq.control([ev], 1, timeout))
+            finally:
+                kq.close()
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while _pid_alive(pid):
+        if deadline is None:
+            time.sleep(2)
             continue
-        pid = int(line)
-        if _pid_alive(pid):
-            pids.add(pid)
-    return pids
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(2, remaining))
+    return True
 
 
-def _write_state_pids(path: Path, pids: Iterable[int]) -> None:
-    uniq = sorted({p for p in pids if p > 0})
-    if not uniq:
+def _alive_pids(pids: Set[int]) -> Set[int]:
+    pids = {p for p in pids if p > 0}
+    if len(pids) > 1:
+        # One directory read answers for every pid at once where /proc exists.
         try:
-            path.unlink()
-        except FileNotFoundError:
+            running = set(os.listdir("/proc"))
+        except OSError:
             pass
-        return
-    path.write_text("".join(f"{p}\n" for p in uniq))
+        else:
+            return {p for p in pids if str(p) in running}
+    return {p for p in pids if _pid_alive(p)}
+
+
+# The state file is an append-only log of "+PID" (attached) and "-PID"
+# (detached) lines; bare "PID" lines from older versions count as "+".
+_STATE_RECORD = re.compile(rb"^[ \t]*([+-]?)(\d+)[ \t\r]*$", re.MULTILINE)
+# Adds only append; once the log grows past this it is folded and rewritten.
+_STATE_COMPACT_SIZE = 4096
+
+
+@contextmanager
+def _locked_state(path: Path):
+    """Open ``path`` and hold an exclusive flock on it for the block."""
+    import fcntl
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield fd
+    finally:
+        os.close(fd)
+
+
+def _read_state_fd(fd: int) -> Set[int]:
+    size = os.fstat(fd).st_size
+    data = os.pread(fd, size, 0) if size else b""
+    pids: Set[int] = set()
+    for sign, digits in _STATE_RECORD.findall(data):
+        if sign == b"-":
+            pids.discard(int(digits))
+        else:
+            pids.add(int(digits))
+    return pids
+
+
+def _rewrite_state_fd(fd: int, pids: Iterable[int]) -> None:
+    uniq = sorted({p for p in pids if p > 0})
+    data = b"".join(b"+%d\n" % p for p in uniq)
+    os.pwrite(fd, data, 0)
+    os.ftruncate(fd, len(data))
+
+
+def _append_state_record(fd: int, record: bytes) -> bool:
+    """Append ``record`` to the locked log; False once it is due for compaction."""
+    size = os.fstat(fd).st_size
+    if size >= _STATE_COMPACT_SIZE:
+        return False
+    if size and os.pread(fd, 1, size - 1) != b"\n":
+        record = b"\n" + record
+    os.pwrite(fd, record, size)
+    return True
 
 
-def _int_or_default(value: str, default: int) -> int:
+def _add_state_pid(path: Path, pid: int) -> None:
+    with _locked_state(path) as fd:
+        if not _append_state_record(fd, b"+%d\n" % pid):
+            _rewrite_state_fd(fd, _alive_pids(_read_state_fd(fd)) | {pid})
+
+
+def _int_or_default(value: str | bytes, default: int) -> int:
     try:
         return int(value)
     except (ValueError, TypeError):
@@ -443,13 +1254,53 @@ def _podman_cmd(*args: str) -> None:
         tty.close()
 
 
+def _inherited_fds() -> list[int] | None:
+    """Inheritable descriptors >= 3 of this process, or None if they can't be listed."""
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        try:
+            names = os.listdir(fd_dir)
+        except OSError:
+            continue
+        fds = []
+        for name in names:
+            fd = int(name)
+            if fd < 3:
+                continue
+            try:
+                if os.get_inheritable(fd):
+                    fds.append(fd)
+            except OSError:
+                # The listing's own directory descriptor, already closed.
+                pass
+        return fds
+    return None
+
+
 def _spawn(*args: str) -> None:
     """
     Spawn a detached helper process.
 
     The first argument should be the executable name (e.g. 'watch-darwin'
     or 'watch-linux'), followed by its arguments.
+
+    Uses posix_spawnp() with setsid where available, which avoids fork()
+    copying the parent's page tables. Unlike Popen it doesn't close inherited
+    descriptors by itself, so stdio is redirected and every other inheritable
+    fd (e.g. pipes handed down by a shell or CI runner) is closed explicitly;
+    the helper outlives the caller and must not hold those open.
     """
+    if hasattr(os, "posix_spawnp"):
+        fds = _inherited_fds()
+        if fds is not None:
+            actions = [
+                (os.POSIX_SPAWN_OPEN, fd, os.devnull, os.O_RDWR, 0) for fd in (0, 1, 2)
+            ]
+            actions += [(os.POSIX_SPAWN_CLOSE, fd) for fd in fds]
+            try:
+                os.posix_spawnp(args[0], list(args), os.environ, file_actions=actions, setsid=True)
+                return
+            except NotImplementedError:
+                pass
     subprocess.Popen(
         list(args),
         stdout=subprocess.DEVNULL,
@@ -459,43 +1310,103 @@ def _spawn(*args: str) -> None:
     )
 
 
-def _is_socket(path: Path) -> bool:
+def _is_socket(path: str | Path) -> bool:
     try:
-        st = path.stat()
+        return stat.S_ISSOCK(os.stat(path).st_mode)
     except FileNotFoundError:
         return False
-    return stat.S_ISSOCK(st.st_mode)
+
+
+def _wait_for_socket(path: Path, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    try:
+        with _dir_watch([path.parent]) as wait:
+            while not _is_socket(path):
+                names: Set[str] | None = set()
+                while names is not None and path.name not in names:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    names = wait(remaining)
+            return True
+    except OSError:
+        pass
+    while not _is_socket(path):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+
+# scheme://[host]/path -> /path
+# e.g. unix:///run/user/1000/podman/podman.sock -> /run/user/1000/podman/podman.sock
+_URI_PATH_RE = re.compile(r"^[^:]*://[^/]*(/.*)$")
+
+
+def _uri_to_path(uri: str) -> str:
+    m = _URI_PATH_RE.match(uri)
+    return m.group(1) if m else ""
+
+
+def _podman_machine_inspect(machine_name: str) -> Dict | None:
+    # One inspect call yields state, socket paths and rootful mode; a non-zero
+    # exit means the machine does not exist yet.
+    proc = _run_bytes(["podman", "machine", "inspect", machine_name])
+    if proc.returncode != 0:
+        return None
+    try:
+        data = json.loads(proc.stdout)
+    except ValueError:
+        return None
+    if isinstance(data, list):
+        data = data[0] if data else None
+    return data if isinstance(data, dict) else None
+
+
+def _podman_remote_socket(host_socket: str) -> str:
+    # Ask the running machine's service where its API socket lives, over the
+    # same connection _podman_api keeps for later requests; "" if unavailable.
+    try:
+        info = _podman_api(host_socket, "GET", "/v4.0.0/libpod/info", timeout=5.0)
+        path = info["host"]["remoteSocket"]["path"]
+    except Exception:
+        return ""
+    if not isinstance(path, str):
+        return ""
+    return _uri_to_path(path) if "://" in path else path
+
+
+# (machine_name, parent_pid) -> (monotonic timestamp, env)
+_docker_host_cache: Dict[tuple[str, int], tuple[float, Dict[str, str]]] = {}
+DOCKER_HOST_CACHE_TTL = 30.0
 
 
 def _ensure_docker_host_darwin(parent_pid: int) -> Dict[str, str]:
     machine_name = "tinyorch"
     state_file = STATE_DIR / machine_name
 
-    alive_pids = _read_state_pids(state_file)
-
-    try:
-        _run(["podman", "machine", "inspect", machine_name], check=True, capture_output=True)
-        proc = _run(
-            [
-                "podman",
-                "machine",
-                "inspect",
-                machine_name,
-                "--format",
-                "{{.State}}",
-            ],
-            check=False,
-            capture_output=True,
-        )
-        machine_state = proc.stdout.strip() if proc.stdout else ""
-    except subprocess.CalledProcessError:
-        cpus_raw = _run(["sysctl", "-n", "hw.ncpu"], check=False, capture_output=True).stdout.strip()
-        mem_bytes_raw = _run(
-            ["sysctl", "-n", "hw.memsize"], check=False, capture_output=True
-        ).stdout.strip()
-        df_proc = _run(["df", "-k", "/"], check=False, capture_output=True)
+    # A repeat call for the same parent shortly after the last one reuses its
+    # result instead of re-inspecting the machine and spawning another
+    # watcher; the parent's pid is already in the state file, so the machine
+    # stays up.
+    cached = _docker_host_cache.get((machine_name, parent_pid))
+    if cached is not None and time.monotonic() - cached[0] < DOCKER_HOST_CACHE_TTL:
+        return dict(cached[1])
+
+    # Register before inspecting: watch_darwin holds the state lock while it
+    # stops the machine, so this either waits for that to finish or keeps it
+    # from happening.
+    _add_state_pid(state_file, parent_pid)
+
+    info = _podman_machine_inspect(machine_name)
+    if info is not None:
+        machine_state = info.get("State") or ""
+    else:
+        cpus_raw = _run_bytes(["sysctl", "-n", "hw.ncpu"]).stdout.strip()
+        mem_bytes_raw = _run_bytes(["sysctl", "-n", "hw.memsize"]).stdout.strip()
+        df_proc = _run_bytes(["df", "-k", "/"])
         fields = df_proc.stdout.splitlines()[1].split()
-        disk_total_kb_raw = fields[1] if len(fields) > 1 else "0"
+        disk_total_kb_raw = fields[1] if len(fields) > 1 else b"0"
 
         cpus = _int_or_default(cpus_raw, 1)
         mem_bytes = _int_or_default(mem_bytes_raw, 0)
@@ -525,72 +1436,28 @@ def _ensure_docker_host_darwin(parent_pid: int) -> Dict[str, str]:
             "/Volumes:/Volumes",
         )
         machine_state = "stopped"
+        info = _podman_machine_inspect(machine_name) or {}
 
     if machine_state != "running":
         _podman_cmd("machine", "start", machine_name)
 
-    all_pids = {parent_pid, *alive_pids}
-    _write_state_pids(state_file, all_pids)
-
-    proc = _run(
-        [
-            "podman",
-            "machine",
-            "inspect",
-            machine_name,
-            "--format",
-            "{{.ConnectionInfo.PodmanSocket.Path}}",
-        ],
-        check=False,
-        capture_output=True,
-    )
-    host_socket = proc.stdout.strip()
+    podman_socket = (info.get("ConnectionInfo") or {}).get("PodmanSocket") or {}
+    host_socket = podman_socket.get("Path") or ""
     if not host_socket:
         raise RuntimeError(
             f"failed to determine podman host-side Docker API socket path for '{machine_name}'"
         )
 
-    vm_socket = ""
-    proc = _run(
-        [
-            "podman",
-            "machine",
-            "inspect",
-            machine_name,
-            "--format",
-            "{{.ConnectionInfo.PodmanSocket.URI}}",
-        ],
-        check=False,
-        capture_output=True,
-    )
-    uri = proc.stdout.strip()
-    if uri:
-        # strip scheme and host to leave path
-        # e.g. unix:///run/user/1000/podman/podman.sock -> /run/user/1000/podman/podman.sock
-        parts = uri.split("://", 1)
-        if len(parts) == 2:
-            after_scheme = parts[1]
-            slash_index = after_scheme.find("/")
-            if slash_index != -1:
-                vm_socket = after_scheme[slash_index:]
-
-    proc = _run(
-        [
-            "podman",
-            "machine",
-            "inspect",
-            machine_name,
-            "--format",
-            "{{.Rootful}}",
-        ],
-        check=False,
-        capture_output=True,
-    )
-    rootful_str = proc.stdout.strip() or "true"
+    vm_socket = _uri_to_path(podman_socket.get("URI") or "")
+
+    rootful_str = str(info.get("Rootful", "true"))
     rootful = rootful_str.lower() != "false"
     if not rootful:
         vm_socket = f"/run/user/{os.getuid()}/podman/podman.sock"
 
+    if not vm_socket:
+        vm_socket = _podman_remote_socket(host_socket)
+
     if not vm_socket:
         proc = _run(
             ["podman", "system", "connection", "ls", "--format", "{{.Default}} {{.URI}}"],
@@ -600,37 +1467,84 @@ def _ensure_docker_host_darwin(parent_pid: int) -> Dict[str, str]:
         for line in proc.stdout.splitlines():
             parts = line.split()
             if len(parts) == 2 and parts[0] == "true":
-                uri = parts[1]
-                u_parts = uri.split("://", 1)
-                if len(u_parts) == 2:
-                    after_scheme = u_parts[1]
-                    slash_index = after_scheme.find("/")
-                    if slash_index != -1:
-                        vm_socket = after_scheme[slash_index:]
-                        break
+                vm_socket = _uri_to_path(parts[1])
+                if vm_socket:
+                    break
 
     if not vm_socket:
         vm_socket = f"/run/user/{os.getuid()}/podman/podman.sock"
 
     _spawn("watch-darwin", machine_name, str(parent_pid), str(state_file))
 
-    return {
+    env = {
         "DOCKER_HOST": f"unix://{host_socket}",
         "DOCKER_SOCKET": vm_socket,
     }
+    _docker_host_cache[(machine_name, parent_pid)] = (time.monotonic(), env)
+    return dict(env)
 
 
-def watch_darwin(machine_name: str, parent_pid: int, state_file: Path) -> None:
-    while _pid_alive(parent_pid):
-        time.sleep(2)
+_podman_api_conns: Dict[str, object] = {}
 
-    remaining = _read_state_pids(state_file)
-    if parent_pid in remaining:
-        remaining.remove(parent_pid)
 
-    if remaining:
-        _write_state_pids(state_file, remaining)
-        return
+def _podman_api(socket_path: str, method: str, url: str, timeout: float = 600.0):
+    """
+    Send a libpod REST request over a podman API socket.
+
+    One HTTP connection is kept per socket and reused by later requests; it is
+    dropped on any transport error so the next call reconnects.
+    """
+    import http.client
+    import socket
+
+    conn = _podman_api_conns.get(socket_path)
+    if conn is None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            sock.close()
+            raise
+        conn = http.client.HTTPConnection("localhost", timeout=timeout)
+        conn.sock = sock
+        _podman_api_conns[socket_path] = conn
+
+    try:
+        conn.request(method, url)
+        resp = conn.getresponse()
+        body = resp.read()
+    except (OSError, http.client.HTTPException):
+        _podman_api_conns.pop(socket_path, None)
+        conn.close()
+        raise
+    if resp.will_close:
+        _podman_api_conns.pop(socket_path, None)
+        conn.close()
+
+    if resp.status >= 400:
+        raise RuntimeError(f"podman API {method} {url} failed: {resp.status} {body[:200]!r}")
+    return json.loads(body) if body else None
+
+
+def _podman_machine_prune(machine_name: str) -> None:
+    # Prune through the machine's API socket rather than `podman machine ssh`,
+    # which starts the podman CLI, an ssh session and podman again in the VM.
+    info = _podman_machine_inspect(machine_name) or {}
+    host_socket = ((info.get("ConnectionInfo") or {}).get("PodmanSocket") or {}).get("Path")
+    if host_socket:
+        from urllib.parse import quote
+
+        filters = quote(json.dumps({"until": ["720h"]}))
+        try:
+            _podman_api(
+                host_socket,
+                "POST",
+                f"/v4.0.0/libpod/system/prune?all=true&volumes=true&filters={filters}",
+            )
+            return
+        except Exception:
+            pass
 
     _podman_cmd(
         "machine",
@@ -646,11 +1560,25 @@ def watch_darwin(machine_name: str, parent_pid: int, state_file: Path) -> None:
         "--filter",
         "until=720h",
     )
-    _podman_cmd("machine", "stop", machine_name)
-    try:
-        state_file.unlink()
-    except FileNotFoundError:
-        pass
+
+
+def watch_darwin(machine_name: str, parent_pid: int, state_file: Path) -> None:
+    _wait_pid_exit(parent_pid)
+
+    # Keep the lock through the shutdown so a concurrent ensure_docker_host
+    # can't register against a machine that is about to stop. The file is
+    # truncated rather than unlinked so every process locks the same inode.
+    with _locked_state(state_file) as fd:
+        remaining = _alive_pids(_read_state_fd(fd) - {parent_pid})
+        if remaining:
+            # Others still need the machine: just log the detach.
+            if not _append_state_record(fd, b"-%d\n" % parent_pid):
+                _rewrite_state_fd(fd, remaining)
+            return
+        _rewrite_state_fd(fd, ())
+
+        _podman_machine_prune(machine_name)
+        _podman_cmd("machine", "stop", machine_name)
 
 
 def _ensure_docker_host_linux(parent_pid: int) -> Dict[str, str]:
@@ -669,11 +1597,7 @@ def _ensure_docker_host_linux(parent_pid: int) -> Dict[str, str]:
     )
     service_pid = proc.pid
 
-    for _ in range(50):
-        if _is_socket(socket_path):
-            break
-        time.sleep(0.1)
-    else:
+    if not _wait_for_socket(socket_path, timeout=5.0):
         try:
             os.kill(service_pid, signal.SIGTERM)
         except OSError:
@@ -691,16 +1615,14 @@ def _ensure_docker_host_linux(parent_pid: int) -> Dict[str, str]:
 
 
 def watch_linux(parent_pid: int, service_pid: int, socket_path: Path) -> None:
-    while _pid_alive(parent_pid):
-        time.sleep(2)
+    _wait_pid_exit(parent_pid)
 
     for sig in (signal.SIGTERM, signal.SIGINT):
         try:
             os.kill(service_pid, sig)
         except OSError:
             break
-        time.sleep(1)
-        if not _pid_alive(service_pid):
+        if _wait_pid_exit(service_pid, timeout=1):
             break
 
     if _pid_alive(service_pid):
@@ -719,7 +1641,7 @@ def ensure_docker_host(parent_pid: int) -> Dict[str, str]:
     if parent_pid <= 0:
         raise ValueError("parent_pid must be positive")
 
-    system = platform.system()
+    system = _system()
     if system == "Darwin":
         return _ensure_docker_host_darwin(parent_pid)
     if system == "Linux":